@@ -1,20 +1,233 @@
+import multiprocessing
 import os
-from glob import glob
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import torch.multiprocessing as torch_mp
+from torch import nn
 from doctr.io import DocumentFile
 from doctr.models import ocr_predictor
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import zipfile
-import tempfile
+import functools
 import re
 import json
 
-# Load the OCR model from docTR
-model = ocr_predictor(pretrained=True)
+# orjson serializes the large results payload several times faster than
+# the stdlib and emits bytes directly; optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# asgiref lets the app be served by an async server (uvicorn/hypercorn)
+# so concurrent /validate requests overlap their zip and I/O work
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+# io_uring lets us submit a whole batch of file reads in one syscall
+# (Linux only); without the binding we fall back to a thread pool
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+# Numba lets the name-equality pass run as compiled code on folders with
+# many images; optional, with a plain Python fallback
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
+
+# How many reads to submit to the kernel per io_uring batch
+_URING_DEPTH = 64
+
+# OCR model and worker pool, both created lazily. Each pool worker loads
+# its own model instance once (via the initializer) so the model is never
+# pickled per task. The locks keep concurrent first requests from racing
+# the initialization and building duplicate pools or models.
+model = None
+_pool = None
+_model_lock = threading.Lock()
+_pool_lock = threading.Lock()
+
+
+def _load_model():
+    """Load the docTR predictor, moved to the GPU in FP16 when available."""
+    predictor = ocr_predictor(pretrained=True)
+    if torch.cuda.is_available():
+        predictor.det_predictor.model = predictor.det_predictor.model.cuda().half()
+        predictor.reco_predictor.model = predictor.reco_predictor.model.cuda().half()
+    else:
+        # On CPU, dynamically quantize the recognizer (the dominant cost,
+        # run once per detected text line) to int8
+        predictor.reco_predictor.model = torch.quantization.quantize_dynamic(
+            predictor.reco_predictor.model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+    return predictor
+
+
+def _init_worker():
+    """Load the docTR model once per pool worker."""
+    global model
+    model = _load_model()
+
+
+def _get_model():
+    """Return the process-local docTR model, loading it on first use."""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = _load_model()
+    return model
+
+
+def _run_model(docs):
+    """Run the predictor under inference mode, with FP16 autocast on GPU."""
+    predictor = _get_model()
+    if torch.cuda.is_available():
+        with torch.inference_mode(), torch.autocast('cuda', dtype=torch.float16):
+            return predictor(docs)
+    with torch.inference_mode():
+        return predictor(docs)
+
+
+def _share_model_memory(predictor):
+    """Move the predictor's weights into shared memory."""
+    for module in (predictor.det_predictor.model, predictor.reco_predictor.model):
+        for param in module.parameters():
+            param.share_memory_()
+
+
+def _get_pool():
+    """Return the shared worker pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                start_methods = torch_mp.get_all_start_methods()
+                if 'fork' in start_methods and not torch.cuda.is_available():
+                    # Load the model in the parent and move its weights to
+                    # shared memory before forking, so every worker maps the
+                    # same copy instead of loading its own
+                    _share_model_memory(_get_model())
+                    _pool = torch_mp.get_context('fork').Pool(
+                        processes=os.cpu_count())
+                else:
+                    # CUDA contexts don't survive fork; keep the per-worker load
+                    _pool = torch_mp.get_context('spawn').Pool(
+                        processes=os.cpu_count(), initializer=_init_worker)
+    return _pool
+
+# Image extensions we accept (lowercase)
+IMG_EXTS = ('.png', '.jpg', '.jpeg')
 
 # Keywords to search for
 keywords = ["Prénom", "Nom", "Le candidat(e)"]
 
+# Precompiled patterns so every line is scanned once in C instead of with
+# per-keyword Python substring searches
+_KEYWORD_RE = re.compile(
+    '(' + '|'.join(re.escape(k) for k in keywords) + r')\s*:?\s*([^\n]*)')
+_FALLBACK_RE = re.compile(r'(nom|prénom|prenom)\s*:\s*([^\n]*)', re.IGNORECASE)
+_CANDIDAT_RE = re.compile(r'candidat', re.IGNORECASE)
 
+
+def _read_images_uring(paths):
+    """Read files by submitting batched io_uring reads, one syscall per batch."""
+    ring = liburing.io_uring()
+    liburing.io_uring_queue_init(_URING_DEPTH, ring, 0)
+    buffers = []
+    fds = []
+    try:
+        for start in range(0, len(paths), _URING_DEPTH):
+            batch = paths[start:start + _URING_DEPTH]
+            for index, path in enumerate(batch, start):
+                fd = os.open(path, os.O_RDONLY)
+                fds.append(fd)
+                buf = bytearray(os.fstat(fd).st_size)
+                buffers.append(buf)
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_read(sqe, fd, buf, len(buf), 0)
+                # Tag the SQE so its completion can be matched back to the
+                # buffer it filled (completions arrive in any order)
+                sqe.user_data = index
+            liburing.io_uring_submit(ring)
+            cqe = liburing.io_uring_cqe()
+            for _ in batch:
+                liburing.io_uring_wait_cqe(ring, cqe)
+                index = cqe.user_data
+                nread = liburing.trap_error(cqe.res)
+                liburing.io_uring_cqe_seen(ring, cqe)
+                if nread != len(buffers[index]):
+                    # A short read would silently leave a zeroed tail in the
+                    # buffer; bail out so read_all_images falls back to the
+                    # thread pool and rereads everything
+                    raise OSError(
+                        f"short read: got {nread} of {len(buffers[index])} "
+                        f"bytes for {paths[index]}")
+        return [bytes(buf) for buf in buffers]
+    finally:
+        for fd in fds:
+            os.close(fd)
+        liburing.io_uring_queue_exit(ring)
+
+
+def _read_one_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_images_threaded(paths):
+    """Read files concurrently from a thread pool (non-Linux fallback)."""
+    with ThreadPoolExecutor(max_workers=min(_URING_DEPTH, len(paths))) as executor:
+        return list(executor.map(_read_one_image, paths))
+
+
+def read_all_images(paths):
+    """Preload image bytes for DocumentFile.from_images."""
+    if not paths:
+        return []
+    if liburing is not None:
+        try:
+            return _read_images_uring(paths)
+        except Exception as e:
+            print(f"io_uring read failed, falling back to threads: {e}")
+    return _read_images_threaded(paths)
+
+
+if njit is not None:
+    @njit(nogil=True, cache=True)
+    def _all_equal_bytes(arr):
+        for i in range(1, arr.shape[0]):
+            for j in range(arr.shape[1]):
+                if arr[i, j] != arr[0, j]:
+                    return False
+        return True
+
+
+def all_names_equal(names):
+    """Check that every extracted name matches the first one."""
+    if len(names) < 2:
+        return True
+    if njit is not None:
+        # Pack the names into a fixed-width byte matrix so the compiled
+        # kernel can compare them without the interpreter
+        encoded = [name.encode('utf-8') for name in names]
+        width = max(len(b) for b in encoded)
+        arr = np.zeros((len(encoded), width), dtype=np.uint8)
+        for i, b in enumerate(encoded):
+            arr[i, :len(b)] = np.frombuffer(b, dtype=np.uint8)
+        return bool(_all_equal_bytes(arr))
+    first = names[0]
+    return all(name == first for name in names)
+
+
+@functools.lru_cache(maxsize=4096)
 def normalize_value(value):
     """Clean and normalize extracted values."""
     value = value.replace(":", "").strip()
@@ -23,6 +236,14 @@ def normalize_value(value):
 
 def reformat_name(name_info):
     """Reformat names into a consistent format."""
+    # Images of the same document often yield identical raw output, so
+    # cache on the (hashable) items of the extracted dict
+    return _reformat_name_cached(frozenset(name_info.items()))
+
+
+@functools.lru_cache(maxsize=4096)
+def _reformat_name_cached(items):
+    name_info = dict(items)
     if "Prénom" in name_info and "Nom" in name_info:
         return f"{normalize_value(name_info['Prénom'])} {normalize_value(name_info['Nom'])}"
     elif "Le candidat(e)" in name_info:
@@ -34,129 +255,206 @@ def reformat_name(name_info):
     return None
 
 
-def extract_names(text, keywords):
-    """Extract names using keywords."""
-    name_info = {}
-    lines = text.split("\n")
-
-    for line in lines:
-        for keyword in keywords:
-            if keyword in line:
-                value = line.split(keyword)[-1].strip()
-                name_info[keyword] = value
-                break
-
-    return name_info
+def postprocess_page(page):
+    """Extract name info from one OCR'd page.
 
-
-def extract_capital_words(result):
-    """Extract capitalized words from OCR result."""
+    Walks the page tree once, building each line's text straight from its
+    words, instead of paying for a full render() and then re-scanning the
+    resulting string. The capital words needed by the fallback are
+    collected during the same walk.
+    """
+    name_info = {}
+    lines = []
     capital_words = []
-    for page in result.pages:
-        for block in page.blocks:
-            for line in block.lines:
-                for word in line.words:
-                    word_text = word.value
-                    if word_text.isupper() and len(word_text) > 2:
+
+    for block in page.blocks:
+        for line in block.lines:
+            words = [word.value for word in line.words]
+            line_text = " ".join(words)
+            lines.append(line_text)
+
+            # First attempt: keyword match on the line — one C-level scan
+            # of the combined pattern instead of a per-keyword Python loop
+            m = _KEYWORD_RE.search(line_text)
+            if m:
+                name_info[m.group(1)] = m.group(2).strip()
+
+            # Collect capital words for the fallback in the same pass
+            if len(capital_words) < 7:
+                for word_text in words:
+                    # Length check first: cheaper than scanning the string
+                    if len(word_text) > 2 and word_text.isupper():
                         capital_words.append(word_text)
-    return capital_words
+                        if len(capital_words) >= 7:
+                            break
 
+    if name_info:
+        return name_info
 
-def process_image(image_path):
-    """Process individual image for name extraction."""
-    try:
-        # Load and process the image
-        doc = DocumentFile.from_images(image_path)
-        result = model(doc)
-        extracted_text = result.render()
-
-        # First attempt: Extract names using keywords
-        name_info = extract_names(extracted_text, keywords)
+    # Fallback: use the collected capitalized words
+    if len(capital_words) >= 7:
+        return {
+            "Prénom": capital_words[5],
+            "Nom": capital_words[6]
+        }
 
-        if name_info:
-            return name_info
+    # Additional fallback: Look for key/value patterns in the text
+    extracted_text = "\n".join(lines)
+    for m in _FALLBACK_RE.finditer(extracted_text):
+        key = m.group(1).lower()
+        if key in ('prénom', 'prenom'):
+            name_info['Prénom'] = m.group(2).strip()
         else:
-            # Fallback: Extract capitalized words
-            capital_words = extract_capital_words(result)
-
-            # Check if there are enough capitalized words
-            if len(capital_words) >= 7:
-                return {
-                    "Prénom": capital_words[5],
-                    "Nom": capital_words[6]
-                }
+            name_info['Nom'] = m.group(2).strip()
+
+    for i, line_text in enumerate(lines):
+        if _CANDIDAT_RE.search(line_text) and i + 1 < len(lines):
+            name_info['Le candidat(e)'] = lines[i + 1].strip()
 
-            # Additional fallback: Look for patterns in the text
-            lines = extracted_text.split('\n')
-            for i, line in enumerate(lines):
-                if ':' in line:
-                    parts = line.split(':')
-                    key = parts[0].strip().lower()
-                    value = parts[1].strip()
-                    if 'nom' in key:
-                        name_info['Nom'] = value
-                    elif 'prénom' in key or 'prenom' in key:
-                        name_info['Prénom'] = value
+    if name_info:
+        return name_info
 
-                if 'candidat' in line.lower() and i + 1 < len(lines):
-                    name_info['Le candidat(e)'] = lines[i + 1].strip()
+    return None
 
-            if name_info:
-                return name_info
 
+def process_image(image, label=None):
+    """Process an individual image (path or raw bytes) for name extraction."""
+    try:
+        # Load and process the image
+        doc = DocumentFile.from_images(image)
+        result = _run_model(doc)
+        return postprocess_page(result.pages[0])
     except Exception as e:
-        print(f"Error processing {image_path}: {e}")
+        print(f"Error processing {label or image}: {e}")
 
     return None
 
 
+def _process_subdir(task):
+    """Pool task: OCR all images of one subfolder in a single batched call.
+
+    `images` is a list of (file_name, source) pairs where source is either
+    a filesystem path or the raw image bytes (for entries read straight
+    out of an uploaded zip).
+    """
+    subdir, images = task
+    file_names = [file_name for file_name, _ in images]
+    sources = [source for _, source in images]
+    try:
+        if sources and isinstance(sources[0], str):
+            sources = read_all_images(sources)
+        docs = DocumentFile.from_images(sources)
+        result = _run_model(docs)
+        pages = result.pages
+    except Exception as e:
+        # One corrupt file fails the whole batched call, so retry the
+        # folder image by image rather than blanking every file in it
+        print(f"Error processing {subdir} as a batch, retrying per image: {e}")
+        return subdir, [(file_name, process_image(source, label=file_name))
+                        for file_name, source in images]
+
+    folder_results = []
+    for file_name, page in zip(file_names, pages):
+        try:
+            folder_results.append((file_name, postprocess_page(page)))
+        except Exception as e:
+            print(f"Error processing {file_name}: {e}")
+            folder_results.append((file_name, None))
+    return subdir, folder_results
+
+
+def _process_folders_parallel(images_by_subdir):
+    """Batch-OCR each subfolder's images across the worker pool.
+
+    Returns a dict mapping (subdir, file_name) to the extracted name info,
+    so callers can regroup results in their original order.
+    """
+    names_by_image = {}
+    for subdir, folder_results in _get_pool().imap_unordered(
+            _process_subdir, list(images_by_subdir.items())):
+        for file_name, names in folder_results:
+            names_by_image[(subdir, file_name)] = names
+    return names_by_image
+
+
+def process_folders(images_by_subdir):
+    """OCR every folder's images and yield one result per folder.
+
+    Takes a mapping of subdir -> list of (file_name, path_or_bytes) pairs
+    and yields (subdir, file_results, extracted_names), where file_results
+    is a list of (file_name, name_info, formatted_name) in the folder's
+    original file order. Both endpoints adapt this into their response
+    shapes; the pool keeps image loading and inference overlapped across
+    workers.
+    """
+    names_by_image = _process_folders_parallel(images_by_subdir)
+    for subdir, images in images_by_subdir.items():
+        file_results = []
+        extracted_names = []
+        for file_name, _ in images:
+            names = names_by_image[(subdir, file_name)]
+            formatted_name = reformat_name(names) if names else None
+            file_results.append((file_name, names, formatted_name))
+            if formatted_name:
+                extracted_names.append(formatted_name)
+        yield subdir, file_results, extracted_names
+
+
+def _dumps(payload):
+    """Serialize payload to a JSON string, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(payload).decode()
+    return json.dumps(payload)
+
+
+def _json_response(payload):
+    """Build a JSON response, bypassing jsonify's stdlib encoder if we can."""
+    if orjson is not None:
+        return Response(orjson.dumps(payload), mimetype='application/json')
+    return jsonify(payload)
+
+
 def compare_names_in_folder(folder_path):
     """Compare names across images in a folder."""
-    subdirs = [d for d in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, d))]
+    with os.scandir(folder_path) as it:
+        subdirs = sorted(entry.name for entry in it if entry.is_dir())
     results = []
 
+    # Gather all images across subfolders so the pool can process them at once
+    images_by_subdir = {}
     for subdir in subdirs:
         subdir_path = os.path.join(folder_path, subdir)
-        image_paths = []
-        for ext in ['*.png', '*.jpg', '*.jpeg']:
-            pattern = os.path.join(subdir_path, ext)
-            image_paths.extend(glob(pattern))
+        with os.scandir(subdir_path) as it:
+            images = [(entry.name, entry.path) for entry in it
+                      if entry.is_file() and entry.name.lower().endswith(IMG_EXTS)]
 
-        if not image_paths:
-            continue
+        if images:
+            images_by_subdir[subdir] = images
 
+    for subdir, file_results, extracted_names in process_folders(images_by_subdir):
         # Extract CIN from folder name (assuming format like "BB567890_Name")
         cin = subdir.split('_')[0] if '_' in subdir else 'Unknown'
 
         student_result = {
             'cin': cin,
             'folder_name': subdir,
-            'extracted_names': [],
+            'extracted_names': extracted_names,
             'is_correct': False,
             'verified_name': None,
-            'files_processed': []
+            'files_processed': [
+                {'file': file_name, 'extracted_name': formatted_name}
+                for file_name, _, formatted_name in file_results
+                if formatted_name
+            ]
         }
 
-        for image_path in image_paths:
-            names = process_image(image_path)
-            if names:
-                formatted_name = reformat_name(names)
-                if formatted_name:
-                    student_result['extracted_names'].append(formatted_name)
-                    student_result['files_processed'].append({
-                        'file': os.path.basename(image_path),
-                        'extracted_name': formatted_name
-                    })
-
-        if student_result['extracted_names']:
-            first_name = student_result['extracted_names'][0]
-            if all(name == first_name for name in student_result['extracted_names']):
-                student_result['is_correct'] = True
-                student_result['verified_name'] = first_name
+        if extracted_names and all_names_equal(extracted_names):
+            student_result['is_correct'] = True
+            student_result['verified_name'] = extracted_names[0]
 
         results.append(student_result)
 
-    return json.dumps(results)
+    return _dumps(results)
 
 
 # Flask Application
@@ -170,69 +468,57 @@ def validate_folder():
         return jsonify({"error": "No file uploaded"})
 
     uploaded_file = request.files['file']
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, uploaded_file.filename)
-    uploaded_file.save(zip_path)
-
-    extract_dir = os.path.join(temp_dir, "extracted")
-    os.makedirs(extract_dir, exist_ok=True)
 
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
+        # Read image entries straight out of the zip, grouped by subfolder,
+        # instead of extracting everything to disk and globbing it back.
+        # Werkzeug already spools the upload to memory or a temp file, so
+        # the zip is read in place without saving our own copy first.
+        images_by_subdir = defaultdict(list)
+        with zipfile.ZipFile(uploaded_file.stream) as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMG_EXTS):
+                    continue
+                parts = info.filename.split('/')
+                if len(parts) != 2:
+                    continue
+                subdir, file_name = parts
+                images_by_subdir[subdir].append((file_name, zip_ref.read(info)))
 
         results = []
-        subdirs = [d for d in os.listdir(extract_dir) if os.path.isdir(os.path.join(extract_dir, d))]
-
-        for subdir in subdirs:
-            subdir_path = os.path.join(extract_dir, subdir)
-            image_paths = []
-            for ext in ['*.png', '*.jpg', '*.jpeg']:
-                pattern = os.path.join(subdir_path, ext)
-                image_paths.extend(glob(pattern))
-
-            if not image_paths:
-                continue
-
-            extracted_names = []
-            file_details = []
-
-            # Process each image in the folder
-            for image_path in image_paths:
-                names = process_image(image_path)
-                formatted_name = reformat_name(names) if names else None
-
-                file_details.append({
-                    "file": os.path.basename(image_path),
+        for subdir, file_results, extracted_names in process_folders(images_by_subdir):
+            file_details = [
+                {
+                    "file": file_name,
                     "extracted_name": formatted_name,
                     "raw_data": names
-                })
-
-                if formatted_name:
-                    extracted_names.append(formatted_name)
+                }
+                for file_name, names, formatted_name in file_results
+            ]
 
-            # Determine if all names match
+            # Determine if all names match and collect errors in one pass
             is_correct = False
             verified_name = None
             errors = []
 
             if extracted_names:
                 first_name = extracted_names[0]
-                is_correct = all(name == first_name for name in extracted_names)
-                verified_name = first_name if is_correct else None
-
-                # Generate errors for mismatches
+                is_correct = True
                 for detail in file_details:
-                    if not detail["extracted_name"]:
+                    extracted_name = detail["extracted_name"]
+                    if not extracted_name:
                         errors.append({
                             "file": detail["file"],
                             "error": "No name could be extracted"
                         })
-                    elif not is_correct and detail["extracted_name"] != first_name:
+                        is_correct = False
+                    elif extracted_name != first_name:
                         errors.append({
                             "file": detail["file"],
-                            "error": f"Name mismatch: found '{detail['extracted_name']}'"
+                            "error": f"Name mismatch: found '{extracted_name}'"
                         })
+                        is_correct = False
+                verified_name = first_name if is_correct else None
 
             # Get CIN from folder name
             cin = subdir.split('_')[0] if '_' in subdir else subdir
@@ -245,14 +531,28 @@ def validate_folder():
                 "file_details": file_details
             })
 
-        return jsonify(results)
+        return _json_response(results)
     except Exception as e:
         return jsonify({"error": str(e)})
-    finally:
-        # Clean up temporary files
-        import shutil
-        shutil.rmtree(temp_dir)
+
+
+# ASGI entry point, e.g. `hypercorn app:asgi_app` or
+# `uvicorn app:asgi_app`; concurrent requests then share the worker pool,
+# which coalesces their folders into the same stream of inference tasks.
+# The pool is created eagerly here, while the process is still
+# single-threaded: forking it later from a request handler would risk
+# deadlocking children on locks inherited mid-operation.
+if WsgiToAsgi is not None:
+    asgi_app = WsgiToAsgi(app)
+    # Only the top-level server process may build the pool at import:
+    # spawn workers re-import this module while bootstrapping, and
+    # creating a pool inside a bootstrapping child is forbidden by
+    # multiprocessing and would crash-loop the workers
+    if multiprocessing.parent_process() is None:
+        _get_pool()
 
 
 if __name__ == '__main__':
-    app.run(host='localhost', port=81)
\ No newline at end of file
+    # Dev fallback only; threaded so concurrent requests don't serialize
+    _get_pool()
+    app.run(host='localhost', port=81, threaded=True)
\ No newline at end of file